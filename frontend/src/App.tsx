@@ -17,6 +17,8 @@ interface PredictionResult {
 }
 
 const API_URL = 'http://localhost:8000';
+const IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.webp', '.bmp'];
+const IMAGE_TYPES = ['image/png', 'image/jpeg', 'image/webp', 'image/bmp'];
 
 function App() {
   const [activeTab, setActiveTab] = useState<'single' | 'batch'>('single');
@@ -80,8 +82,8 @@ function App() {
     setSingleError(null);
     setSingleResult(null);
 
-    if (selectedFile.type !== 'image/png') {
-      setSingleError('Please upload a valid PNG image.');
+    if (!IMAGE_TYPES.includes(selectedFile.type)) {
+      setSingleError('Please upload a valid PNG, JPEG, WEBP or BMP image.');
       setFile(null);
       setPreview(null);
       return;
@@ -117,8 +119,8 @@ function App() {
   // --- Batch Prediction Handlers ---
   const handleFolderChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     const files = Array.from(e.target.files || []);
-    const pngFiles = files.filter(f => f.name.toLowerCase().endsWith('.png'));
-    setBatchFiles(pngFiles);
+    const imageFiles = files.filter(f => IMAGE_EXTENSIONS.some(ext => f.name.toLowerCase().endsWith(ext)));
+    setBatchFiles(imageFiles);
     setBatchResults([]);
     setBatchError(null);
   };
@@ -454,10 +456,10 @@ function App() {
                 onDrop={(e) => { e.preventDefault(); setIsDragging(false); const f = e.dataTransfer.files[0]; if (f) validateAndSetSingleFile(f); }}
                 onClick={() => fileInputRef.current?.click()}
               >
-                <input type="file" ref={fileInputRef} hidden accept="image/png" onChange={(e) => { const f = e.target.files?.[0]; if (f) validateAndSetSingleFile(f); }} />
+                <input type="file" ref={fileInputRef} hidden accept={IMAGE_TYPES.join(',')} onChange={(e) => { const f = e.target.files?.[0]; if (f) validateAndSetSingleFile(f); }} />
                 <div className="icon"><Upload size={48} strokeWidth={1.5} /></div>
                 <p><strong>Drop your icon here</strong>or click to browse</p>
-                <div className="info-badge"><Info size={14} /> Only PNG supported</div>
+                <div className="info-badge"><Info size={14} /> PNG, JPEG, WEBP or BMP</div>
               </div>
               <button className="upload-btn" onClick={handleSingleUpload} disabled={!file || singleLoading}>
                 {singleLoading ? 'Running Inference...' : <><Cpu size={20} /> Analyze Telltale</>}
@@ -1,16 +1,53 @@
 import os
+
+# oneDNN CPU kernels, with BF16 math where the CPU supports it (AVX-512 BF16 / AMX).
+# Must be set before TensorFlow is imported; the environment can override both.
+os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "1")
+os.environ.setdefault("ONEDNN_DEFAULT_FPMATH_MODE", "BF16")
+
 import json
+import glob
+import asyncio
+import threading
+import csv
+import time
+import sys
+import subprocess
+import tempfile
 import numpy as np
-import pandas as pd
+import cv2
+import xlsxwriter
 import tensorflow as tf
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from PIL import Image, ImageOps
+from PIL import Image
 import io
-from typing import List
+from dataclasses import dataclass
+from typing import Callable, List
 from datetime import datetime
-from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
+
+# Optional Numba JIT for the preprocessing kernel
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Optional TensorRT acceleration (GPU deploys only)
+try:
+    import tensorrt as trt
+    import pycuda.driver as cuda
+    import pycuda.autoinit
+except Exception:
+    # Not installed, or no CUDA device to initialise
+    trt = None
+
+# Pin TF's thread pools before any op initialises the runtime
+try:
+    tf.config.threading.set_intra_op_parallelism_threads(os.cpu_count() or 1)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+except RuntimeError as e:
+    print(f"Could not configure TF threading: {str(e)}")
 
 app = FastAPI(title="Telltale Prediction API")
 
@@ -28,15 +65,280 @@ app.add_middleware(
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODELS_DIR = os.path.join(BASE_DIR, "models")
 ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 32))
+MAX_WAIT_MS = float(os.environ.get("MAX_WAIT_MS", 10))
+PREPROCESS_CONCURRENCY = min(8, os.cpu_count() or 1)
+# Set to 0 to skip the FP32 numerics check (it briefly loads a second model copy)
+CHECK_NUMERICS = os.environ.get("CHECK_NUMERICS", "1") == "1"
+
+DEFAULT_MODEL = "14_telltael_v1"
+DEFAULT_IMG_SIZE = (224, 224)
+
+@dataclass(frozen=True)
+class ModelBundle:
+    model: tf.keras.Model
+    class_names: tuple
+    class_names_arr: np.ndarray
+    img_size: tuple
+    name: str
+    preprocess_fn: Callable[[np.ndarray], np.ndarray]
+    infer_fn: Callable[[np.ndarray], np.ndarray]
+
+# Shared State (swapped as a whole by /switch-model, never mutated in place)
+app.state.bundle = None
+
+class TRTEngine:
+    def __init__(self, engine_path: str, img_size):
+        self.logger = trt.Logger(trt.Logger.WARNING)
+        self.cuda_ctx = pycuda.autoinit.context
+        # Everything below is bound to the CUDA context that __call__ pushes,
+        # also when loading from a worker thread (/switch-model)
+        self.cuda_ctx.push()
+        try:
+            with open(engine_path, "rb") as f:
+                self.engine = trt.Runtime(self.logger).deserialize_cuda_engine(f.read())
+            if self.engine is None:
+                raise RuntimeError(f"Could not deserialize TensorRT engine at {engine_path}")
+            self.input_name = self.engine.get_tensor_name(0)
+            self.output_name = self.engine.get_tensor_name(1)
+
+            # The profile must cover every batch up to MAX_BATCH at this image size
+            _, _, max_shape = self.engine.get_tensor_profile_shape(self.input_name, 0)
+            expected = (MAX_BATCH, img_size[0], img_size[1], 3)
+            if tuple(max_shape) != expected:
+                raise RuntimeError(f"TensorRT engine profile {tuple(max_shape)} does not match {expected}")
+
+            # Context, pinned/device buffers and stream are allocated once for
+            # MAX_BATCH and reused; calls slice them down to the batch size
+            in_shape = (MAX_BATCH,) + tuple(self.engine.get_tensor_shape(self.input_name))[1:]
+            out_shape = (MAX_BATCH,) + tuple(self.engine.get_tensor_shape(self.output_name))[1:]
+            self.context = self.engine.create_execution_context()
+            self.h_input = cuda.pagelocked_empty(in_shape, np.float32)
+            self.h_output = cuda.pagelocked_empty(out_shape, np.float32)
+            self.d_input = cuda.mem_alloc(self.h_input.nbytes)
+            self.d_output = cuda.mem_alloc(self.h_output.nbytes)
+            self.context.set_tensor_address(self.input_name, int(self.d_input))
+            self.context.set_tensor_address(self.output_name, int(self.d_output))
+            self.stream = cuda.Stream()
+            self.lock = threading.Lock()
+        finally:
+            self.cuda_ctx.pop()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        n = len(batch)
+        with self.lock:
+            # Push the CUDA context so this also works from worker threads
+            self.cuda_ctx.push()
+            try:
+                if not self.context.set_input_shape(self.input_name, batch.shape):
+                    raise RuntimeError(f"TensorRT rejected input shape {batch.shape}")
+                h_input = self.h_input[:n]
+                h_output = self.h_output[:n]
+                np.copyto(h_input, batch)
+
+                cuda.memcpy_htod_async(self.d_input, h_input, self.stream)
+                if not self.context.execute_async_v3(self.stream.handle):
+                    raise RuntimeError("TensorRT execution failed")
+                cuda.memcpy_dtoh_async(h_output, self.d_output, self.stream)
+                self.stream.synchronize()
+                return h_output.copy()
+            finally:
+                self.cuda_ctx.pop()
+
+def build_trt_engine(keras_model, engine_path: str, img_size):
+    import tf2onnx
+
+    # Export Keras -> ONNX
+    spec = (tf.TensorSpec((None, img_size[0], img_size[1], 3), tf.float32, name="input"),)
+    onnx_model, _ = tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=17)
+
+    # Build FP16 engine from ONNX
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+    if not parser.parse(onnx_model.SerializeToString()):
+        errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+        raise RuntimeError(f"ONNX parse failed: {errors}")
+
+    config = builder.create_builder_config()
+    if builder.platform_has_fast_fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+    min_shape = (1, img_size[0], img_size[1], 3)
+    max_shape = (MAX_BATCH, img_size[0], img_size[1], 3)
+    profile = builder.create_optimization_profile()
+    profile.set_shape(network.get_input(0).name, min_shape, max_shape, max_shape)
+    config.add_optimization_profile(profile)
+
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError("TensorRT engine build failed")
+    with open(engine_path, "wb") as f:
+        f.write(serialized)
+
+def load_trt_engine(keras_model, model_name: str, img_size):
+    if trt is None:
+        return None
+
+    # Key the cached engine on the Keras file and MAX_BATCH, so replacing
+    # model.keras or raising MAX_BATCH builds a fresh engine
+    model_dir = os.path.join(MODELS_DIR, model_name)
+    st = os.stat(os.path.join(model_dir, "model.keras"))
+    engine_path = os.path.join(model_dir, f"model-{st.st_mtime_ns}-{st.st_size}-b{MAX_BATCH}.trt")
+    try:
+        if not os.path.exists(engine_path):
+            for stale in glob.glob(os.path.join(model_dir, "model*.trt")):
+                os.remove(stale)
+            print(f"Building TensorRT FP16 engine for '{model_name}'...")
+            # Build under the same CUDA context the engine will run in
+            pycuda.autoinit.context.push()
+            try:
+                build_trt_engine(keras_model, engine_path, img_size)
+            finally:
+                pycuda.autoinit.context.pop()
+        engine = TRTEngine(engine_path, img_size)
+        print(f"Using TensorRT engine: {engine_path}")
+        return engine
+    except Exception as e:
+        # Some EfficientNet variants fail to convert, keep the Keras path
+        print(f"TensorRT unavailable, falling back to Keras: {str(e)}")
+        return None
+
+def _bucket_size(n: int) -> int:
+    # Round batches up to a power of two so XLA / TFLite only ever see a
+    # handful of shapes instead of re-compiling / re-planning per batch size
+    return min(MAX_BATCH, 1 << (n - 1).bit_length())
+
+def warm_up(backend, img_size):
+    # Pay XLA compilation / cuDNN autotuning / TFLite planning once per
+    # bucket size here instead of on the first real requests of that size
+    h, w = img_size
+    for batch_size in sorted({_bucket_size(n) for n in range(1, MAX_BATCH + 1)}):
+        start = time.perf_counter()
+        backend(np.zeros((batch_size, h, w, 3), np.float32))
+        print(f"Warm-up batch={batch_size}: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def _pad_to_bucket(batch: np.ndarray) -> np.ndarray:
+    n = len(batch)
+    size = _bucket_size(n)
+    if size == n:
+        return batch
+    padded = np.zeros((size,) + batch.shape[1:], np.float32)
+    padded[:n] = batch
+    return padded
+
+class TFLiteModel:
+    def __init__(self, tflite_path: str):
+        self.interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input["shape"][0])
+        # The interpreter is not thread-safe
+        self.lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        n = len(batch)
+        batch = _pad_to_bucket(batch)
+        with self.lock:
+            if len(batch) != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(batch)
+
+            # Quantize the float input with the calibrated scale/zero point
+            scale, zero_point = self.input["quantization"]
+            if scale:
+                limits = np.iinfo(self.input["dtype"])
+                batch = np.clip(np.round(batch / scale + zero_point), limits.min, limits.max)
+            self.interpreter.set_tensor(self.input["index"], batch.astype(self.input["dtype"]))
+            self.interpreter.invoke()
+            out = self.interpreter.get_tensor(self.output["index"])
+
+            scale, zero_point = self.output["quantization"]
+            if scale and out.dtype != np.float32:
+                out = (out.astype(np.float32) - zero_point) * scale
+            return out[:n]
+
+def load_tflite_model(model_name: str):
+    tflite_path = os.path.join(MODELS_DIR, model_name, "model.tflite")
+    if not os.path.exists(tflite_path):
+        return None
+    # INT8 CPU kernels only pay off without a GPU
+    if tf.config.list_physical_devices("GPU"):
+        return None
+
+    try:
+        tflite_model = TFLiteModel(tflite_path)
+        print(f"Using INT8 TFLite model: {tflite_path}")
+        return tflite_model
+    except Exception as e:
+        print(f"TFLite model unusable, falling back to Keras: {str(e)}")
+        return None
 
-# Shared State
-model = None
-class_names = []
-IMG_SIZE = (224, 224)
-current_model_name = "14_telltael_v1"
+def build_xla_infer(keras_model, img_size):
+    spec = tf.TensorSpec([None, img_size[0], img_size[1], 3], tf.float32)
 
-def load_model_assets(model_name: str):
-    global model, class_names, IMG_SIZE, current_model_name
+    @tf.function(jit_compile=True, input_signature=[spec])
+    def _infer(x):
+        return keras_model(x, training=False)
+
+    def _run(batch: np.ndarray) -> np.ndarray:
+        n = len(batch)
+        return _infer(tf.constant(_pad_to_bucket(batch))).numpy()[:n]
+
+    try:
+        # Compiles every bucket, so no request pays for XLA compilation
+        warm_up(_run, img_size)
+        return _run
+    except Exception as e:
+        print(f"XLA compilation failed, falling back to model.predict: {str(e)}")
+        return None
+
+FP32_REFERENCE_SCRIPT = """
+import sys
+import numpy as np
+import tensorflow as tf
+model = tf.keras.models.load_model(sys.argv[1], compile=False)
+np.save(sys.argv[3], model(np.load(sys.argv[2]), training=False).numpy())
+"""
+
+def fp32_reference(model_path: str, sample: np.ndarray) -> np.ndarray:
+    # oneDNN reads the fpmath mode once per process, so the FP32 reference
+    # has to come from a fresh interpreter with BF16 math switched off.
+    # CPU only: TF uses TF32 on Ampere+ GPUs, and the live process owns the GPU.
+    env = dict(os.environ)
+    env.pop("ONEDNN_DEFAULT_FPMATH_MODE", None)
+    env["TF_ENABLE_ONEDNN_OPTS"] = "0"
+    env["CUDA_VISIBLE_DEVICES"] = ""
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, "sample.npy")
+        out_path = os.path.join(tmp, "reference.npy")
+        np.save(in_path, sample)
+        try:
+            subprocess.run(
+                [sys.executable, "-c", FP32_REFERENCE_SCRIPT, model_path, in_path, out_path],
+                env=env, check=True, capture_output=True, text=True, timeout=600,
+            )
+        except subprocess.CalledProcessError as e:
+            # The command line embeds the whole script; the end of the child's
+            # stderr (after TF's startup logs) holds the actual traceback
+            raise RuntimeError(f"FP32 reference run failed: {e.stderr.strip()[-2000:]}") from None
+        return np.load(out_path)
+
+def check_numerics(model_path: str, backend, img_size):
+    # Compare what will actually serve requests (BF16 oneDNN / XLA / FP16
+    # TensorRT / INT8 TFLite) against a strict FP32 run of the same model
+    rng = np.random.default_rng(0)
+    sample = rng.uniform(0, 255, (1, img_size[0], img_size[1], 3)).astype(np.float32)
+    reference = fp32_reference(model_path, sample)
+    max_delta = float(np.max(np.abs(backend(sample) - reference)))
+    print(f"Numerics check: max |delta| vs FP32 reference = {max_delta:.6f}")
+
+def run_inference(bundle: ModelBundle, input_data: np.ndarray) -> np.ndarray:
+    return bundle.infer_fn(input_data)
+
+def load_model_assets(model_name: str) -> ModelBundle:
     
     model_path = os.path.join(MODELS_DIR, model_name, "model.keras")
     class_map_path = os.path.join(MODELS_DIR, model_name, "class_map.json")
@@ -55,214 +357,540 @@ def load_model_assets(model_name: str):
     with open(class_map_path, "r") as f:
         classes_dict = json.load(f)
         sorted_classes = sorted(classes_dict.items(), key=lambda item: item[1])
-        new_class_names = [name for name, idx in sorted_classes]
-    
-    # Update Globals
-    model = new_model
-    class_names = new_class_names
-    current_model_name = model_name
+        new_class_names = tuple(name for name, idx in sorted_classes)
+
+    # Every output index must map to a class name
+    if new_model.output_shape[-1] != len(new_class_names):
+        raise ValueError(
+            f"Model outputs {new_model.output_shape[-1]} classes but class map has {len(new_class_names)}"
+        )
     
     # Auto-detect IMG_SIZE
-    if model.input_shape and len(model.input_shape) == 4:
-        IMG_SIZE = (model.input_shape[1], model.input_shape[2])
+    img_size = DEFAULT_IMG_SIZE
+    if new_model.input_shape and len(new_model.input_shape) == 4:
+        img_size = (new_model.input_shape[1], new_model.input_shape[2])
+
+    # Pick the fastest backend: TensorRT (GPU), INT8 TFLite (CPU), then XLA.
+    # Every bucket size is warmed once; XLA does it while compiling.
+    infer_fn = load_trt_engine(new_model, model_name, img_size) or load_tflite_model(model_name)
+    if infer_fn is not None:
+        try:
+            warm_up(infer_fn, img_size)
+        except Exception as e:
+            # Built but can't run a real batch, keep the Keras path
+            print(f"Accelerated backend failed warm-up, falling back to Keras: {str(e)}")
+            infer_fn = None
+    if infer_fn is None:
+        infer_fn = build_xla_infer(new_model, img_size)
+
+    if infer_fn is None:
+        infer_fn = lambda batch: new_model.predict(batch, batch_size=len(batch), verbose=0)
+        warm_up(infer_fn, img_size)
+    if CHECK_NUMERICS:
+        try:
+            check_numerics(model_path, infer_fn, img_size)
+        except Exception as e:
+            print(f"Numerics check failed: {str(e)}")
     
-    print(f"Successfully loaded model '{model_name}' with {len(class_names)} classes.")
+    print(f"Successfully loaded model '{model_name}' with {len(new_class_names)} classes.")
+    return ModelBundle(
+        model=new_model,
+        class_names=new_class_names,
+        class_names_arr=np.array(new_class_names, dtype=object),
+        img_size=img_size,
+        name=model_name,
+        preprocess_fn=build_preprocess_fn(img_size),
+        infer_fn=infer_fn,
+    )
+
+async def batcher():
+    # Coalesce concurrent /predict calls into one model call per micro-batch
+    queue = app.state.inference_queue
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(items) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Requests queued across a model switch must stay with their own bundle
+        groups = {}
+        for item in items:
+            groups.setdefault(id(item[0]), []).append(item)
+
+        for group in groups.values():
+            bundle = group[0][0]
+            try:
+                batch = np.concatenate([tensor for _, tensor, _ in group], axis=0)
+                preds = await asyncio.to_thread(run_inference, bundle, batch)
+            except Exception as e:
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for i, (_, _, future) in enumerate(group):
+                if not future.done():
+                    future.set_result(preds[i])
 
 @app.on_event("startup")
 async def startup_event():
+    app.state.model_lock = asyncio.Lock()
+    app.state.inference_queue = asyncio.Queue()
+    app.state.batcher_task = asyncio.create_task(batcher())
+
+    # Grow GPU memory on demand instead of reserving all of it up front
+    for gpu in tf.config.list_physical_devices("GPU"):
+        try:
+            tf.config.experimental.set_memory_growth(gpu, True)
+        except RuntimeError as e:
+            print(f"Could not enable memory growth on {gpu.name}: {str(e)}")
+
     try:
         if not os.path.exists(MODELS_DIR):
             os.makedirs(MODELS_DIR)
         
         # Load default model if it exists
-        if os.path.exists(os.path.join(MODELS_DIR, "14_telltael_v1")):
-            load_model_assets("14_telltael_v1")
+        if os.path.exists(os.path.join(MODELS_DIR, DEFAULT_MODEL)):
+            app.state.bundle = load_model_assets(DEFAULT_MODEL)
         else:
             print("WARNING: 'models/default' not found. Please upload a model.")
     except Exception as e:
         print(f"Startup Error: {str(e)}")
 
+def scan_models() -> List[str]:
+    available_models = []
+    with os.scandir(MODELS_DIR) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            # Check if it has required files
+            try:
+                os.stat(os.path.join(entry.path, "model.keras"))
+                os.stat(os.path.join(entry.path, "class_map.json"))
+            except OSError:
+                continue
+            available_models.append(entry.name)
+    return available_models
+
 @app.get("/models")
 async def list_models():
-    if not os.path.exists(MODELS_DIR):
+    try:
+        available_models = await asyncio.to_thread(scan_models)
+    except FileNotFoundError:
         return []
     
-    available_models = []
-    for d in os.listdir(MODELS_DIR):
-        if os.path.isdir(os.path.join(MODELS_DIR, d)):
-            # Check if it has required files
-            if os.path.exists(os.path.join(MODELS_DIR, d, "model.keras")) and \
-               os.path.exists(os.path.join(MODELS_DIR, d, "class_map.json")):
-                available_models.append(d)
-    
+    bundle = app.state.bundle
     return {
         "models": available_models,
-        "current": current_model_name
+        "current": bundle.name if bundle is not None else DEFAULT_MODEL
     }
 
 @app.post("/switch-model")
 async def switch_model(name: str):
+    # One switch at a time; requests keep using the old bundle until the
+    # new one is fully loaded and swapped in with a single assignment
+    async with app.state.model_lock:
+        try:
+            bundle = await asyncio.to_thread(load_model_assets, name)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        app.state.bundle = bundle
+    return {"status": "success", "model": name}
+
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+class UnsupportedImageError(ValueError):
+    pass
+
+def check_image_size(contents: bytes):
+    # Read the dimensions from the header only and refuse decompression bombs
+    # before any pixel buffer is allocated (OpenCV's own limit is 2^30 pixels)
     try:
-        load_model_assets(name)
-        return {"status": "success", "model": name}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        with Image.open(io.BytesIO(contents)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError as e:
+        raise UnsupportedImageError(str(e))
+    except Exception:
+        raise UnsupportedImageError("Could not read the image header.")
+    if Image.MAX_IMAGE_PIXELS and width * height > Image.MAX_IMAGE_PIXELS:
+        raise UnsupportedImageError(
+            f"Image is too large ({width}x{height}), limit is {Image.MAX_IMAGE_PIXELS} pixels."
+        )
 
-def preprocess_image(img: Image.Image):
-    print(f"DEBUG: Processing image mode={img.mode}, size={img.size}")
-    # STEP 0: Handle Smart Transparency
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
+def decode_image(contents: bytes) -> np.ndarray:
+    check_image_size(contents)
+    # Decode straight to an RGBA uint8 array with OpenCV (libjpeg-turbo / libpng)
+    arr = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_UNCHANGED)
+    if arr is None:
+        # Formats OpenCV was built without, let Pillow handle them
+        return np.asarray(Image.open(io.BytesIO(contents)).convert('RGBA'))
 
-    # Analyze content brightness to decide background color
-    np_img = np.array(img)
+    if arr.dtype == np.uint16:
+        arr = (arr >> 8).astype(np.uint8)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2RGBA)
+    if arr.shape[2] == 4:
+        return cv2.cvtColor(arr, cv2.COLOR_BGRA2RGBA)
+    return cv2.cvtColor(arr, cv2.COLOR_BGR2RGBA)
+
+def has_allowed_extension(filename: str) -> bool:
+    return os.path.splitext(filename or "")[1].lower() in ALLOWED_EXTENSIONS
+
+def _is_supported(header: bytes) -> bool:
+    # Sniff the file signature (PNG / JPEG / WEBP / BMP) from the first 12 bytes
+    return (
+        header.startswith(b"\x89PNG\r\n\x1a\n")
+        or header.startswith(b"\xff\xd8\xff")
+        or (header.startswith(b"RIFF") and header[8:12] == b"WEBP")
+        or header.startswith(b"BM")
+    )
+
+def load_upload_image(upload: UploadFile) -> np.ndarray:
+    # Read from the spooled temp file directly so the raw bytes only live
+    # for the duration of the decode (call from a worker thread)
+    f = upload.file
+    f.seek(0)
+    if not _is_supported(f.read(12)):
+        raise UnsupportedImageError("File content is not a supported image (PNG, JPEG, WEBP, BMP).")
+    f.seek(0)
+    return decode_image(f.read())
+
+def preprocess_image(np_img: np.ndarray, img_size: tuple):
+    print(f"DEBUG: Processing image shape={np_img.shape}")
+    # STEP 0: Handle Smart Transparency
     alpha = np_img[:, :, 3]
     rgb = np_img[:, :, :3]
     mask = alpha > 10
-    
+
+    # Analyze content brightness to decide background color
     if mask.any():
         avg_content = np.mean(rgb[mask])
         print(f"DEBUG: Content brightness={avg_content}")
         if avg_content < 128:
-            bg_color = (255, 255, 255)
+            bg_value = 255.0
             print("DEBUG: Using WHITE background")
         else:
-            bg_color = (0, 0, 0)
+            bg_value = 0.0
             print("DEBUG: Using BLACK background")
     else:
-        bg_color = (0, 0, 0)
+        bg_value = 0.0
 
-    # Composite on selected background
-    bg = Image.new("RGB", img.size, bg_color)
-    bg.paste(img, mask=img.split()[3])
-    img = bg
-
-    # STEP 1: Convert to Grayscale
-    gray_img = img.convert("L")
+    # STEP 1: Composite on selected background and convert to Grayscale
+    # (grayscale first: blending against a gray background commutes with the weights)
+    gray = rgb.astype(np.float32) @ GRAY_WEIGHTS
+    a = alpha.astype(np.float32) / 255.0
+    gray = gray * a + bg_value * (1.0 - a)
+    gray = np.clip(gray + 0.5, 0, 255).astype(np.uint8)
 
     # Invert if background is light
-    w, h = gray_img.size
-    corners = [
-        gray_img.getpixel((0, 0)),
-        gray_img.getpixel((w - 1, 0)),
-        gray_img.getpixel((0, h - 1)),
-        gray_img.getpixel((w - 1, h - 1))
-    ]
-    avg_bg = sum(corners) / 4
+    avg_bg = (int(gray[0, 0]) + int(gray[0, -1]) + int(gray[-1, 0]) + int(gray[-1, -1])) / 4.0
     print(f"DEBUG: Corner brightness={avg_bg}")
     if avg_bg > 127:
         print("DEBUG: Inverting image to get Light on Dark")
-        gray_img = ImageOps.invert(gray_img)
-
-    # STEP 2: Apply autocontrast
-    gray_img = ImageOps.autocontrast(gray_img)
+        np.subtract(255, gray, out=gray)
 
-    # STEP 3: Convert grayscale to 3-channel
-    np_img_gray = np.array(gray_img)
-    rgb_like_img = np.stack([np_img_gray, np_img_gray, np_img_gray], axis=-1)
+    # STEP 2: Apply autocontrast (same LUT as ImageOps.autocontrast)
+    lo, hi = int(gray.min()), int(gray.max())
+    if hi > lo:
+        scale = 255.0 / (hi - lo)
+        lut = np.clip(np.arange(256) * scale - lo * scale, 0, 255).astype(np.uint8)
+        gray = lut[gray]
 
-    # STEP 4: Resize
-    pil_img = Image.fromarray(rgb_like_img)
-    resized_img = pil_img.resize(IMG_SIZE, Image.BILINEAR)
+    # STEP 3: Resize the single grayscale plane once
+    # (INTER_AREA when shrinking to match PIL's antialiased bilinear downscale)
+    shrinking = gray.shape[0] > img_size[0] or gray.shape[1] > img_size[1]
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    resized = cv2.resize(gray, (img_size[1], img_size[0]), interpolation=interpolation)
 
-    # STEP 5: Normalize and Preprocess for EfficientNet
-    arr = np.array(resized_img).astype(np.float32)
+    # STEP 4: Broadcast to 3-channel float batch
+    # EfficientNet's preprocess_input is a pass-through (the model rescales
+    # internally), so the raw 0-255 values are fed as-is.
+    arr = np.broadcast_to(resized[:, :, None], resized.shape + (3,)).astype(np.float32)
     arr = np.expand_dims(arr, axis=0)
-    arr = efficientnet_preprocess(arr)
 
     return arr
 
+def _build_numba_kernel(img_size: tuple):
+    # out_h / out_w are closure constants, so Numba specializes the loops for them
+    out_h, out_w = img_size
+
+    # Serial on purpose: parallelism comes from the per-request worker threads,
+    # and a parallel kernel would oversubscribe them (or abort the process under
+    # Numba's non-threadsafe workqueue layer when called concurrently)
+    @numba.njit(fastmath=True, nogil=True)
+    def _kernel(rgba):
+        h, w = rgba.shape[0], rgba.shape[1]
+
+        # Pass 1: content brightness under the alpha mask decides the background
+        row_sum = np.zeros(h, np.float64)
+        row_cnt = np.zeros(h, np.int64)
+        for y in range(h):
+            row_total = 0.0
+            row_count = 0
+            for x in range(w):
+                if rgba[y, x, 3] > 10:
+                    row_total += np.float64(rgba[y, x, 0]) + rgba[y, x, 1] + rgba[y, x, 2]
+                    row_count += 1
+            row_sum[y] = row_total
+            row_cnt[y] = row_count
+        count = row_cnt.sum()
+        bg = 0.0
+        if count > 0 and row_sum.sum() / (3 * count) < 128:
+            bg = 255.0
+
+        # Pass 2: grayscale + alpha composite, tracking the value range
+        gray = np.empty((h, w), np.uint8)
+        row_min = np.empty(h, np.int64)
+        row_max = np.empty(h, np.int64)
+        for y in range(h):
+            row_lo = 255
+            row_hi = 0
+            for x in range(w):
+                a = rgba[y, x, 3] / 255.0
+                g = 0.299 * rgba[y, x, 0] + 0.587 * rgba[y, x, 1] + 0.114 * rgba[y, x, 2]
+                v = int(min(max(g * a + bg * (1.0 - a) + 0.5, 0.0), 255.0))
+                gray[y, x] = v
+                row_lo = min(row_lo, v)
+                row_hi = max(row_hi, v)
+            row_min[y] = row_lo
+            row_max[y] = row_hi
+        lo = row_min.min()
+        hi = row_max.max()
+
+        # Invert + autocontrast folded into one 256-entry LUT
+        corners = (int(gray[0, 0]) + int(gray[0, w - 1]) + int(gray[h - 1, 0]) + int(gray[h - 1, w - 1])) / 4.0
+        invert = corners > 127
+        if invert:
+            lo, hi = 255 - hi, 255 - lo
+        lut = np.empty(256, np.float32)
+        scale = 255.0 / (hi - lo) if hi > lo else 1.0
+        for i in range(256):
+            u = 255 - i if invert else i
+            if hi > lo:
+                u = int(min(max(u * scale - lo * scale, 0.0), 255.0))
+            lut[i] = u
+
+        # Pass 3: area-average resize straight into the 3-channel float batch
+        out = np.empty((1, out_h, out_w, 3), np.float32)
+        for oy in range(out_h):
+            y0 = oy * h // out_h
+            y1 = max(y0 + 1, (oy + 1) * h // out_h)
+            for ox in range(out_w):
+                x0 = ox * w // out_w
+                x1 = max(x0 + 1, (ox + 1) * w // out_w)
+                acc = 0.0
+                for y in range(y0, y1):
+                    for x in range(x0, x1):
+                        acc += lut[gray[y, x]]
+                mean = acc / ((y1 - y0) * (x1 - x0))
+                out[0, oy, ox, 0] = mean
+                out[0, oy, ox, 1] = mean
+                out[0, oy, ox, 2] = mean
+        return out
+
+    return _kernel
+
+def build_preprocess_fn(img_size: tuple) -> Callable[[np.ndarray], np.ndarray]:
+    def _numpy(np_img: np.ndarray) -> np.ndarray:
+        return preprocess_image(np_img, img_size)
+
+    if numba is None:
+        return _numpy
+
+    try:
+        kernel = _build_numba_kernel(img_size)
+
+        def _preprocess(np_img: np.ndarray) -> np.ndarray:
+            # The area-average kernel only downsamples; upscaling keeps the NumPy path
+            if np_img.shape[0] < img_size[0] or np_img.shape[1] < img_size[1]:
+                return _numpy(np_img)
+            # Writable + C-contiguous, the only layout compiled at load time
+            # (the Pillow decode fallback returns a read-only array)
+            return kernel(np.require(np_img, np.uint8, requirements="CW"))
+
+        # Compile now rather than on the first request
+        _preprocess(np.zeros((img_size[0], img_size[1], 4), np.uint8))
+        return _preprocess
+    except Exception as e:
+        print(f"Numba preprocess unavailable, using NumPy path: {str(e)}")
+        return _numpy
+
+def top5_rows(bundle: ModelBundle, preds: np.ndarray):
+    # O(C) partition for the k best columns per row, then sort just those k
+    # (k < 5 for models with fewer than 5 classes)
+    k = min(5, preds.shape[1])
+    rows = np.arange(len(preds))[:, None]
+    part = np.argpartition(preds, -k, axis=1)[:, -k:]
+    top_idx = part[rows, np.argsort(-preds[rows, part], axis=1)]
+    # tolist() already yields Python floats / strs, no per-item conversion needed
+    return bundle.class_names_arr[top_idx].tolist(), preds[rows, top_idx].tolist()
+
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
-    # 1. Validate File Extension
-    if not file.filename.lower().endswith(".png"):
-        raise HTTPException(status_code=400, detail="Only PNG images are allowed.")
+    # 1. Validate File Extension (magic bytes are checked while decoding)
+    if not has_allowed_extension(file.filename):
+        raise HTTPException(status_code=400, detail="Only PNG, JPEG, WEBP or BMP images are allowed.")
+
+    # Read the bundle once so a concurrent /switch-model can't mix models
+    bundle = app.state.bundle
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="No model loaded.")
 
     try:
-        # 2. Read contents
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        # 2. Read + decode off the event loop
+        try:
+            image = await asyncio.to_thread(load_upload_image, file)
+        except UnsupportedImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 3. Preprocess
-        input_data = preprocess_image(image)
+        # 3. Preprocess (CPU-bound, also off the event loop)
+        input_data = await asyncio.to_thread(bundle.preprocess_fn, image)
         
-        # 4. Predict
-        predictions = model.predict(input_data)[0]
+        # 4. Predict (queued for the micro-batcher)
+        future = asyncio.get_running_loop().create_future()
+        await app.state.inference_queue.put((bundle, input_data, future))
+        predictions = await future
         
         # Get Top 5
-        top_indices = np.argsort(predictions)[-5:][::-1]
-        top5 = []
-        for idx in top_indices:
-            name = class_names[idx] if idx < len(class_names) else "Unknown"
-            top5.append({
-                "class": name,
-                "confidence": float(predictions[idx])
-            })
-            
-        confidence = float(predictions[top_indices[0]])
-        predicted_class_name = top5[0]["class"]
+        top_names, top_confs = top5_rows(bundle, predictions[None, :])
+        top_names, top_confs = top_names[0], top_confs[0]
+        top5 = [{"class": n, "confidence": c} for n, c in zip(top_names, top_confs)]
 
         return {
-            "prediction": predicted_class_name,
-            "confidence": confidence,
+            "prediction": top_names[0],
+            "confidence": top_confs[0],
             "filename": file.filename,
             "top5": top5
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/predict-batch")
 async def predict_batch(files: List[UploadFile] = File(...)):
+    bundle = app.state.bundle
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="No model loaded.")
+
     results = []
+    tensors = []
+    slots = []  # position in results for each tensor
+    semaphore = asyncio.Semaphore(PREPROCESS_CONCURRENCY)
+
+    async def _prep(file: UploadFile):
+        async with semaphore:
+            try:
+                tensor = await asyncio.to_thread(
+                    lambda: bundle.preprocess_fn(load_upload_image(file))
+                )
+                return file.filename, tensor, None
+            except Exception as e:
+                return file.filename, None, e
+
+    # Skip non-images for batch, decode + preprocess the rest in parallel
+    image_files = [f for f in files if has_allowed_extension(f.filename)]
+    prepped = await asyncio.gather(*[_prep(f) for f in image_files])
     
-    for file in files:
-        if not file.filename.lower().endswith(".png"):
-            continue # Skip non-pngs for batch
-            
+    for filename, tensor, err in prepped:
+        if err is not None:
+            results.append({
+                "filename": filename,
+                "prediction": "Error",
+                "confidence": 0,
+                "status": str(err)
+            })
+            continue
+        tensors.append(tensor)
+        slots.append(len(results))
+        results.append({"filename": filename})
+
+    # Predict in chunks of MAX_BATCH images, one model call per chunk
+    for start in range(0, len(tensors), MAX_BATCH):
+        chunk_slots = slots[start:start + MAX_BATCH]
         try:
-            contents = await file.read()
-            image = Image.open(io.BytesIO(contents))
+            batch = np.concatenate(tensors[start:start + MAX_BATCH], axis=0)
+            preds = await asyncio.to_thread(run_inference, bundle, batch)
             
-            input_data = preprocess_image(image)
-            predictions = model.predict(input_data)[0]
+            # Get Top 5 per row
+            top_names, top_confs = top5_rows(bundle, preds)
             
-            # Get Top 5
-            top_indices = np.argsort(predictions)[-5:][::-1]
-            top5 = []
-            for idx in top_indices:
-                name = class_names[idx] if idx < len(class_names) else "Unknown"
-                top5.append({
-                    "class": name,
-                    "confidence": float(predictions[idx])
+            for slot, names, confs in zip(chunk_slots, top_names, top_confs):
+                top5 = [{"class": n, "confidence": c} for n, c in zip(names, confs)]
+                
+                results[slot].update({
+                    "prediction": names[0],
+                    "confidence": confs[0],
+                    "status": "Success",
+                    "top5": top5
                 })
-            
-            confidence = float(predictions[top_indices[0]])
-            predicted_class_name = top5[0]["class"]
-            
-            results.append({
-                "filename": file.filename,
-                "prediction": predicted_class_name,
-                "confidence": confidence,
-                "status": "Success",
-                "top5": top5
-            })
         except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "prediction": "Error",
-                "confidence": 0,
-                "status": str(e)
-            })
+            for slot in chunk_slots:
+                results[slot].update({
+                    "prediction": "Error",
+                    "confidence": 0,
+                    "status": str(e)
+                })
             
     return results
 
+def report_fieldnames(results: List[dict]) -> List[str]:
+    # Columns in first-seen key order
+    return list(dict.fromkeys(k for r in results for k in r.keys()))
+
+def _excel_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def build_xlsx_report(results: List[dict], metadata: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    fieldnames = report_fieldnames(results)
+
+    # constant_memory streams each row out as soon as the next one starts,
+    # so rows must be written strictly top to bottom. Filenames and statuses
+    # are user input: keep them literal text, never hyperlinks or formulas.
+    workbook = xlsxwriter.Workbook(buffer, {
+        "constant_memory": True,
+        "strings_to_urls": False,
+        "strings_to_formulas": False,
+    })
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+
+    sheet = workbook.add_worksheet("Prediction Report")
+    sheet.write_row(0, 0, fieldnames, header_format)
+    for row, result in enumerate(results, start=1):
+        sheet.write_row(row, 0, [_excel_value(result.get(k)) for k in fieldnames])
+
+    # Add metadata sheet
+    meta_sheet = workbook.add_worksheet("Metadata")
+    meta_sheet.write_row(0, 0, ["Field", "Value"], header_format)
+    for row, item in enumerate(metadata.items(), start=1):
+        meta_sheet.write_row(row, 0, item)
+
+    workbook.close()
+    buffer.seek(0)
+    return buffer
+
+def build_csv_report(results: List[dict]) -> io.BytesIO:
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=report_fieldnames(results), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(results)
+    return io.BytesIO(text.getvalue().encode())
+
 @app.post("/export-report")
 async def export_report(results: List[dict], format: str = "xlsx"):
     try:
         if not results:
             raise HTTPException(status_code=400, detail="No results to export")
-            
-        df = pd.DataFrame(results)
         
         # Add production metadata
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -273,16 +901,9 @@ async def export_report(results: List[dict], format: str = "xlsx"):
             "Model": "EfficientNetB7-Batch"
         }
         
-        buffer = io.BytesIO()
-        
         if format.lower() == "xlsx":
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Prediction Report')
-                # Add metadata sheet
-                meta_df = pd.DataFrame(list(metadata.items()), columns=["Field", "Value"])
-                meta_df.to_excel(writer, index=False, sheet_name='Metadata')
-            
-            buffer.seek(0)
+            # Workbook serialization is CPU-bound, keep it off the event loop
+            buffer = await asyncio.to_thread(build_xlsx_report, results, metadata)
             return StreamingResponse(
                 buffer,
                 media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
@@ -290,9 +911,7 @@ async def export_report(results: List[dict], format: str = "xlsx"):
             )
         else:
             # Default to CSV
-            csv_str = df.to_csv(index=False)
-            buffer.write(csv_str.encode())
-            buffer.seek(0)
+            buffer = build_csv_report(results)
             return StreamingResponse(
                 buffer,
                 media_type="text/csv",
@@ -305,7 +924,7 @@ async def export_report(results: List[dict], format: str = "xlsx"):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model_loaded": model is not None, "version": "2.0"}
+    return {"status": "ok", "model_loaded": app.state.bundle is not None, "version": "2.0"}
 
 if __name__ == "__main__":
     import uvicorn
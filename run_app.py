@@ -14,7 +14,7 @@ def run_app():
     # 1. Start Backend (FastAPI)
     print("📦 Starting Backend (Port 8000)...")
     backend_proc = subprocess.Popen(
-        [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000"],
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000", "--workers", "1"],
         cwd=base_dir
     )
 
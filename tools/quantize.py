@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+# Reuse the exact preprocessing the API applies at inference time
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+import main
+
+CALIBRATION_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.webp", "*.bmp")
+
+def calibration_images(calib_dir: str, limit: int):
+    paths = []
+    for pattern in CALIBRATION_PATTERNS:
+        paths.extend(glob.glob(os.path.join(calib_dir, "**", pattern), recursive=True))
+    paths = sorted(paths)[:limit]
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {calib_dir}")
+    return paths
+
+def representative_dataset(paths, img_size):
+    # Same preprocess function the server builds for this model, so INT8
+    # ranges are calibrated on exactly what inference will see
+    preprocess = main.build_preprocess_fn(img_size)
+
+    def gen():
+        for path in paths:
+            with open(path, "rb") as f:
+                arr = preprocess(main.decode_image(f.read()))
+            yield [arr.astype(np.float32)]
+    return gen
+
+def quantize(model_path: str, calib_dir: str, limit: int, output_path: str):
+    model = tf.keras.models.load_model(model_path, compile=False)
+    img_size = main.DEFAULT_IMG_SIZE
+    if model.input_shape and len(model.input_shape) == 4:
+        img_size = (model.input_shape[1], model.input_shape[2])
+
+    paths = calibration_images(calib_dir, limit)
+    print(f"Calibrating on {len(paths)} images...")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset(paths, img_size)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    tflite_model = converter.convert()
+
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    print(f"Wrote INT8 model to {output_path} ({len(tflite_model) / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an INT8 TFLite model for CPU inference.")
+    parser.add_argument("model_path", help="Path to models/<name>/model.keras")
+    parser.add_argument("--calib-dir", required=True,
+                        help="Directory of sample images used to calibrate INT8 ranges")
+    parser.add_argument("--limit", type=int, default=200, help="Max calibration images")
+    parser.add_argument("--output", help="Defaults to model.tflite next to the model")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(args.model_path), "model.tflite")
+    quantize(args.model_path, args.calib_dir, args.limit, output)